@@ -0,0 +1,557 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from typing import Iterable, Tuple
+
+# default cell budget of the zone label raster when no resolution is given
+MAX_RASTER_CELLS = 2 ** 22
+# maximum number of point and edge pairs expanded at once by the exact point in polygon test
+MAX_BLOCK_SIZE = 2 ** 20
+
+
+class ZonalStats():
+
+    """Zonal Statistics Class which summarizes cloud point elevations per management zone polygon.
+
+    The zones are rasterized once into a label raster. Points falling in cells that are fully inside a
+    zone are labelled by an index lookup, and only points in cells crossed by a zone boundary go through
+    an exact vectorized even-odd (ray casting) point in polygon test, bucketed by a coarse zone grid.
+    The per zone values are reduced with np.bincount and pandas groupby, so no shapely Point objects are
+    created. Cloud points can be fed in one go or as streamed chunks through update.
+
+    Parameters
+    ----------
+    zones : gpd.GeoDataFrame
+        GeoDataFrame of Polygon or MultiPolygon management zones. Empty or missing geometries are kept
+        but never receive points
+    epsg : str, optional
+        CRS system the cloud points are in. If provided and the zones have a CRS, the zones are
+        reprojected to it, otherwise the zones are assumed to be in the same CRS as the cloud points
+    resolution : float, optional
+        Cell size of the label raster in CRS units. If not provided it is chosen so the raster covering
+        the zones has about MAX_RASTER_CELLS cells
+    """
+
+    def __init__(self, zones: gpd.GeoDataFrame, epsg: str = None, resolution: float = None) -> None:
+        if (epsg and zones.crs is not None):
+            zones = zones.to_crs(epsg=epsg)
+        self.zones = zones
+        self.build_zone_edges()
+        self.build_label_raster(resolution)
+        self.build_zone_grid()
+        self.reset()
+
+    def build_zone_edges(self) -> None:
+        """Extracts the bounds and the ring edges of every polygon part of the zones.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self.valid_zones = np.array([geometry is not None and not geometry.is_empty
+                                     for geometry in self.zones.geometry], dtype=bool)
+        self.zone_bounds = np.full((len(self.zones), 4), np.nan)
+        self.zone_edges = []
+        for zone, geometry in enumerate(self.zones.geometry):
+            parts_edges = []
+            if (self.valid_zones[zone]):
+                self.zone_bounds[zone] = geometry.bounds
+                parts = geometry.geoms if geometry.geom_type == 'MultiPolygon' else [geometry]
+                for part in parts:
+                    # every part is tested on its own so overlapping parts do not cancel out
+                    rings = [np.asarray(part.exterior.coords)[:, :2]]
+                    for interior in part.interiors:
+                        rings.append(np.asarray(interior.coords)[:, :2])
+                    # edges as (x1, y1, x2, y2) rows
+                    parts_edges.append(np.concatenate([np.column_stack([ring[:-1], ring[1:]])
+                                                       for ring in rings]))
+            self.zone_edges.append(parts_edges)
+
+    def get_extent(self) -> Tuple[float, float, float, float]:
+        """Calculates the extent covering all non empty zones.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        tuple
+            Returns the extent of the zones (minx, miny, maxx, maxy)
+        """
+        bounds = self.zone_bounds[self.valid_zones]
+        minx, miny = bounds[:, :2].min(axis=0)
+        maxx, maxy = bounds[:, 2:].max(axis=0)
+
+        return minx, miny, maxx, maxy
+
+    def get_cells(self, x: np.ndarray, y: np.ndarray, bounds: np.ndarray, cell_size: float,
+                  shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Calculates the row and column of the given coordinates in a uniform grid.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            X coordinates
+        y : np.ndarray
+            Y coordinates
+        bounds : np.ndarray
+            Bounds of the grid (minx, miny, maxx, maxy)
+        cell_size : float
+            Cell size of the grid
+        shape : Tuple[int, int]
+            Number of rows and columns of the grid
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Rows and columns of the coordinates, clipped to the grid
+        """
+        rows, cols = shape
+        row = np.clip(np.floor((y - bounds[1]) / cell_size), 0, rows - 1).astype(np.int64)
+        col = np.clip(np.floor((x - bounds[0]) / cell_size), 0, cols - 1).astype(np.int64)
+
+        return row, col
+
+    def build_label_raster(self, resolution: float = None) -> None:
+        """Rasterizes the zones into a label raster holding the zone of every cell fully inside a zone,
+        -1 for cells outside all zones and -2 for cells crossed by a zone boundary.
+
+        Parameters
+        ----------
+        resolution : float, optional
+            Cell size of the label raster in CRS units
+
+        Returns
+        -------
+        None
+        """
+        if (not self.valid_zones.any()):
+            self.raster_bounds = np.zeros(4)
+            self.raster_cell_size = 1.0
+            self.label_raster = np.full((1, 1), -1, dtype=np.int32)
+            self.zone_row_edges = [[] for _ in self.zone_edges]
+            return
+
+        minx, miny, maxx, maxy = self.get_extent()
+        self.raster_bounds = np.array([minx, miny, maxx, maxy])
+        if (not resolution):
+            resolution = np.sqrt((maxx - minx) * (maxy - miny) / MAX_RASTER_CELLS)
+            if (not resolution > 0):
+                resolution = max(maxx - minx, maxy - miny, 1.0) / np.sqrt(MAX_RASTER_CELLS)
+        self.raster_cell_size = resolution
+
+        rows = int((maxy - miny) // resolution) + 1
+        cols = int((maxx - minx) // resolution) + 1
+        self.label_raster = np.full((rows, cols), -1, dtype=np.int32)
+
+        for zone in np.flatnonzero(self.valid_zones):
+            zminx, zminy, zmaxx, zmaxy = self.zone_bounds[zone]
+            (first_row, last_row), (first_col, last_col) = self.get_cells(
+                np.array([zminx, zmaxx]), np.array([zminy, zmaxy]), self.raster_bounds, resolution,
+                (rows, cols))
+            window = self.label_raster[first_row:last_row + 1, first_col:last_col + 1]
+            inside = np.zeros(window.shape, dtype=bool)
+            for edges in self.zone_edges[zone]:
+                inside |= self.fill_polygon(edges, first_row, first_col, window.shape)
+            # overlapping zones keep the first zone, like the exact test
+            window[inside & (window == -1)] = zone
+
+        self.label_raster[self.get_boundary_cells()] = -2
+        self.build_row_edges()
+
+    def fill_polygon(self, edges: np.ndarray, first_row: int, first_col: int,
+                     shape: Tuple[int, int]) -> np.ndarray:
+        """Vectorized even-odd fill of a polygon part over a window of the label raster, testing the cell
+        centres row by row.
+
+        Parameters
+        ----------
+        edges : np.ndarray
+            Ring edges of the polygon part as (x1, y1, x2, y2) rows
+        first_row : int
+            Raster row of the first window row
+        first_col : int
+            Raster column of the first window column
+        shape : Tuple[int, int]
+            Number of rows and columns of the window
+
+        Returns
+        -------
+        np.ndarray
+            Boolean mask of the window cells whose centre is inside the polygon part
+        """
+        rows, cols = shape
+        cell_size = self.raster_cell_size
+        x0 = self.raster_bounds[0] + (first_col + 0.5) * cell_size
+        y0 = self.raster_bounds[1] + (first_row + 0.5) * cell_size
+        x1, y1, x2, y2 = edges.T
+
+        # every window row whose centre line may be crossed by each edge
+        low = np.clip(np.floor((np.minimum(y1, y2) - y0) / cell_size), 0, rows - 1).astype(np.int64)
+        high = np.clip(np.ceil((np.maximum(y1, y2) - y0) / cell_size), 0, rows - 1).astype(np.int64)
+        counts = high - low + 1
+        edge = np.repeat(np.arange(len(edges)), counts)
+        row = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - low, counts)
+        yc = y0 + row * cell_size
+
+        crosses = (y1[edge] > yc) != (y2[edge] > yc)
+        edge = edge[crosses]
+        row = row[crosses]
+        yc = yc[crosses]
+        x_cross = x1[edge] + (yc - y1[edge]) * (x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+
+        # a crossing toggles every cell centre left of it, the number of those centres is its column
+        col = np.clip(np.ceil((x_cross - x0) / cell_size), 0, cols).astype(np.int64)
+        toggles = np.bincount(row * (cols + 1) + col, minlength=rows * (cols + 1)).reshape(rows, cols + 1)
+        crossings = np.cumsum(toggles[:, ::-1], axis=1)[:, ::-1]
+
+        return crossings[:, 1:] % 2 == 1
+
+    def get_edge_rows(self, edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Expands edges into one (edge, row) pair for every label raster row band each edge touches.
+
+        Parameters
+        ----------
+        edges : np.ndarray
+            Edges as (x1, y1, x2, y2) rows
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Edge positions and the raster rows they touch
+        """
+        x1, y1, x2, y2 = edges.T
+        # widened a little so rounding never leaves a touched row out
+        eps = self.raster_cell_size * 1e-6
+        first_row, _ = self.get_cells(x1, np.minimum(y1, y2) - eps, self.raster_bounds,
+                                      self.raster_cell_size, self.label_raster.shape)
+        last_row, _ = self.get_cells(x1, np.maximum(y1, y2) + eps, self.raster_bounds,
+                                     self.raster_cell_size, self.label_raster.shape)
+        counts = last_row - first_row + 1
+        edge = np.repeat(np.arange(len(edges)), counts)
+        row = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - first_row, counts)
+
+        return edge, row
+
+    def build_row_edges(self) -> None:
+        """Indexes the edges of every polygon part by the label raster rows they touch, so the exact
+        test of a point only looks at the edges of its own row band.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self.zone_row_edges = []
+        for parts_edges in self.zone_edges:
+            parts_row_edges = []
+            for edges in parts_edges:
+                edge, row = self.get_edge_rows(edges)
+                order = np.argsort(row, kind='stable')
+                first_row = row.min()
+                offsets = np.r_[0, np.cumsum(np.bincount(row - first_row))]
+                parts_row_edges.append((first_row, offsets, edges[edge[order]]))
+            self.zone_row_edges.append(parts_row_edges)
+
+    def get_boundary_cells(self) -> np.ndarray:
+        """Finds every label raster cell touched by an edge of any zone.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        np.ndarray
+            Boolean mask of the boundary cells of the label raster
+        """
+        rows, cols = self.label_raster.shape
+        cell_size = self.raster_cell_size
+        miny = self.raster_bounds[1]
+        edges = np.concatenate([edges for parts_edges in self.zone_edges for edges in parts_edges])
+        x1, y1, x2, y2 = edges.T
+        ymin = np.minimum(y1, y2)
+        ymax = np.maximum(y1, y2)
+        eps = cell_size * 1e-6
+        edge, row = self.get_edge_rows(edges)
+
+        # x range of every edge inside every row band it spans
+        band_low = np.clip(miny + row * cell_size, ymin[edge], ymax[edge])
+        band_high = np.clip(miny + (row + 1) * cell_size, ymin[edge], ymax[edge])
+        flat = y1[edge] == y2[edge]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = (x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+            x_low = np.where(flat, x1[edge], x1[edge] + (band_low - y1[edge]) * slope)
+            x_high = np.where(flat, x2[edge], x1[edge] + (band_high - y1[edge]) * slope)
+        _, span_first = self.get_cells(np.minimum(x_low, x_high) - eps, band_low, self.raster_bounds,
+                                       cell_size, (rows, cols))
+        _, span_last = self.get_cells(np.maximum(x_low, x_high) + eps, band_low, self.raster_bounds,
+                                      cell_size, (rows, cols))
+
+        size = rows * (cols + 1)
+        spans = (np.bincount(row * (cols + 1) + span_first, minlength=size) -
+                 np.bincount(row * (cols + 1) + span_last + 1, minlength=size))
+
+        return np.cumsum(spans.reshape(rows, cols + 1), axis=1)[:, :cols] > 0
+
+    def build_zone_grid(self) -> None:
+        """Builds the coarse uniform grid used to bucket the boundary cell points, with about one zone
+        per cell over the extent of the zones.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self.grid_zones = np.flatnonzero(self.valid_zones)
+        if (len(self.grid_zones) == 0):
+            self.grid_bounds = np.zeros(4)
+            self.grid_cell_size = 1.0
+            self.grid_shape = (1, 1)
+            self.zone_cells = np.zeros((0, 4), dtype=np.int64)
+            return
+
+        minx, miny, maxx, maxy = self.get_extent()
+        self.grid_bounds = np.array([minx, miny, maxx, maxy])
+        cell_size = np.sqrt((maxx - minx) * (maxy - miny) / len(self.grid_zones))
+        if (not cell_size > 0):
+            cell_size = max(maxx - minx, maxy - miny, 1.0)
+        self.grid_cell_size = cell_size
+        self.grid_shape = (int((maxy - miny) // cell_size) + 1, int((maxx - minx) // cell_size) + 1)
+
+        # (first row, first column, last row, last column) of the cells overlapped by each zone
+        bounds = self.zone_bounds[self.grid_zones]
+        self.zone_cells = np.column_stack(
+            self.get_cells(bounds[:, 0], bounds[:, 1], self.grid_bounds, cell_size, self.grid_shape) +
+            self.get_cells(bounds[:, 2], bounds[:, 3], self.grid_bounds, cell_size, self.grid_shape))
+
+    def reset(self) -> None:
+        """Clears the accumulated statistics so a new set of cloud points can be summarized.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        zone_count = len(self.zones)
+        self.count = np.zeros(zone_count, dtype=np.int64)
+        self.elevation_sum = np.zeros(zone_count, dtype=float)
+        self.elevation_min = np.full(zone_count, np.inf)
+        self.elevation_max = np.full(zone_count, -np.inf)
+
+    def points_in_polygon(self, x: np.ndarray, y: np.ndarray,
+                          row_edges: Tuple[int, np.ndarray, np.ndarray]) -> np.ndarray:
+        """Vectorized even-odd point in polygon test of the given points against a polygon part, only
+        counting the crossings of the edges touching the raster row band of every point.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            X coordinates of the points
+        y : np.ndarray
+            Y coordinates of the points
+        row_edges : Tuple[int, np.ndarray, np.ndarray]
+            First raster row, row offsets and row sorted (x1, y1, x2, y2) edges of the polygon part
+
+        Returns
+        -------
+        np.ndarray
+            Boolean mask of the points found inside the polygon part
+        """
+        first_row, offsets, edges = row_edges
+        row, _ = self.get_cells(x, y, self.raster_bounds, self.raster_cell_size, self.label_raster.shape)
+        row -= first_row
+        in_rows = (row >= 0) & (row < len(offsets) - 1)
+        row = np.where(in_rows, row, 0)
+        starts = offsets[row]
+        counts = np.where(in_rows, offsets[row + 1] - starts, 0)
+
+        inside = np.zeros(len(x), dtype=bool)
+        block = max(1, MAX_BLOCK_SIZE // max(1, counts.max(initial=0)))
+        for start in range(0, len(x), block):
+            block_counts = counts[start:start + block]
+            point = np.repeat(np.arange(start, start + len(block_counts)), block_counts)
+            edge = np.arange(block_counts.sum()) - np.repeat(
+                np.cumsum(block_counts) - block_counts - starts[start:start + block], block_counts)
+            x1, y1, x2, y2 = edges[edge].T
+            py = y[point]
+            crosses = (y1 > py) != (y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            hits = point[crosses & (x[point] < x_cross)]
+            inside[start:start + block] = np.bincount(hits - start, minlength=len(block_counts)) % 2 == 1
+
+        return inside
+
+    def assign_boundary_zones(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Assigns points to zones with the exact point in polygon test, only testing every zone against
+        the points of the grid cells its bounds overlap.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            X coordinates of the points
+        y : np.ndarray
+            Y coordinates of the points
+
+        Returns
+        -------
+        np.ndarray
+            Zone position of every point, -1 for points outside all zones
+        """
+        labels = np.full(len(x), -1, dtype=np.int64)
+        if (len(x) == 0):
+            return labels
+
+        # sort the points by grid cell so the points of a row of cells form one contiguous slice
+        cols = self.grid_shape[1]
+        row, col = self.get_cells(x, y, self.grid_bounds, self.grid_cell_size, self.grid_shape)
+        cell_ids = row * cols + col
+        order = np.argsort(cell_ids, kind='stable')
+        cell_ids = cell_ids[order]
+        x = x[order]
+        y = y[order]
+        sorted_labels = np.full(len(order), -1, dtype=np.int64)
+
+        for zone, (first_row, first_col, last_row, last_col) in zip(self.grid_zones, self.zone_cells):
+            minx, miny, maxx, maxy = self.zone_bounds[zone]
+            rows = np.arange(first_row, last_row + 1) * cols
+            starts = np.searchsorted(cell_ids, rows + first_col, side='left')
+            ends = np.searchsorted(cell_ids, rows + last_col, side='right')
+            candidates = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+            candidates = candidates[(sorted_labels[candidates] == -1) &
+                                    (x[candidates] >= minx) & (x[candidates] <= maxx) &
+                                    (y[candidates] >= miny) & (y[candidates] <= maxy)]
+            if (len(candidates) == 0):
+                continue
+            inside = np.zeros(len(candidates), dtype=bool)
+            for row_edges in self.zone_row_edges[zone]:
+                inside |= self.points_in_polygon(x[candidates], y[candidates], row_edges)
+            sorted_labels[candidates[inside]] = zone
+
+        labels[order] = sorted_labels
+
+        return labels
+
+    def assign_zones(self, cloud_points: np.ndarray) -> np.ndarray:
+        """Assigns every cloud point to the zone containing it.
+
+        Parameters
+        ----------
+        cloud_points : np.ndarray
+            Array of cloud points with x, y and elevation columns
+
+        Returns
+        -------
+        np.ndarray
+            Zone position of every point, -1 for points outside all zones. Points in overlapping zones
+            are assigned to the first zone
+        """
+        rows, cols = self.label_raster.shape
+        row = np.floor((cloud_points[:, 1] - self.raster_bounds[1]) / self.raster_cell_size)
+        col = np.floor((cloud_points[:, 0] - self.raster_bounds[0]) / self.raster_cell_size)
+        in_raster = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+        cells = np.where(in_raster, row * cols + col, 0).astype(np.int64)
+        labels = np.where(in_raster, self.label_raster.ravel()[cells], -1).astype(np.int64)
+
+        boundary = np.flatnonzero(labels == -2)
+        labels[boundary] = self.assign_boundary_zones(cloud_points[boundary, 0], cloud_points[boundary, 1])
+
+        return labels
+
+    def update(self, cloud_points: np.ndarray) -> None:
+        """Adds a chunk of cloud points to the accumulated zonal statistics. Points with a missing
+        coordinate or elevation are ignored.
+
+        Parameters
+        ----------
+        cloud_points : np.ndarray
+            Array of cloud points with x, y and elevation columns
+
+        Returns
+        -------
+        None
+        """
+        cloud_points = np.asarray(cloud_points, dtype=float).reshape(-1, 3)
+        labels = self.assign_zones(cloud_points)
+        labels[~np.isfinite(cloud_points).all(axis=1)] = -1
+        if (not (labels >= 0).any()):
+            return
+
+        # unmatched points all land in the first bin, which is dropped
+        elevations = cloud_points[:, 2]
+        zone_count = len(self.zones)
+        self.count += np.bincount(labels + 1, minlength=zone_count + 1)[1:]
+        self.elevation_sum += np.bincount(labels + 1, weights=np.where(labels >= 0, elevations, 0),
+                                          minlength=zone_count + 1)[1:]
+
+        grouped = pd.Series(elevations).groupby(labels, sort=False)
+        elevation_min = grouped.min().drop(-1, errors='ignore')
+        elevation_max = grouped.max().drop(-1, errors='ignore')
+        zones = elevation_min.index.to_numpy()
+        self.elevation_min[zones] = np.minimum(self.elevation_min[zones], elevation_min.to_numpy())
+        self.elevation_max[zones] = np.maximum(self.elevation_max[zones], elevation_max.to_numpy())
+
+    def get_stats(self) -> pd.DataFrame:
+        """Calculates and returns the zonal statistics from the cloud points accumulated so far.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        pd.DataFrame
+            Dataframe indexed like the zones with point count, mean, min and max elevation, relief and
+            point density (points per squared CRS unit). Zones without points have NaN elevation values
+            and empty or missing zones also have a NaN point density
+        """
+        empty = self.count == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.elevation_sum / self.count
+            density = self.count / self.zones.geometry.area.to_numpy(dtype=float)
+        elevation_min = np.where(empty, np.nan, self.elevation_min)
+        elevation_max = np.where(empty, np.nan, self.elevation_max)
+
+        stats = pd.DataFrame(index=self.zones.index)
+        stats['count'] = self.count
+        stats['mean_elevation'] = np.where(empty, np.nan, mean)
+        stats['min_elevation'] = elevation_min
+        stats['max_elevation'] = elevation_max
+        stats['relief'] = elevation_max - elevation_min
+        stats['point_density'] = np.where(self.valid_zones, density, np.nan)
+
+        return stats
+
+    def compute(self, chunks: Iterable[np.ndarray]) -> pd.DataFrame:
+        """Calculates the zonal statistics of streamed chunks of cloud points.
+
+        Parameters
+        ----------
+        chunks : Iterable[np.ndarray]
+            Chunks of cloud points with x, y and elevation columns
+
+        Returns
+        -------
+        pd.DataFrame
+            Zonal statistics dataframe as returned by get_stats
+        """
+        self.reset()
+        for chunk in chunks:
+            self.update(chunk)
+
+        return self.get_stats()
@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Polygon, MultiPolygon
+from src.zonal_stats import ZonalStats
+
+
+class ZonalStatsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        square = Polygon(((0, 0), (0, 10), (10, 10), (10, 0), (0, 0)))
+        holed = Polygon(((20, 0), (20, 10), (30, 10), (30, 0), (20, 0)),
+                        [((24, 4), (24, 6), (26, 6), (26, 4), (24, 4))])
+        multi = MultiPolygon([Polygon(((40, 0), (40, 5), (45, 5), (45, 0), (40, 0))),
+                              Polygon(((50, 0), (50, 5), (55, 5), (55, 0), (50, 0)))])
+        self.zones = gpd.GeoDataFrame(geometry=[square, holed, multi])
+
+        self.zonal_stats = ZonalStats(self.zones)
+        self.cloud_points = np.array([[1, 1, 100], [9, 9, 110], [5, 5, 105],
+                                      [21, 1, 200], [25, 5, 999], [42, 2, 300],
+                                      [52, 2, 310], [60, 60, 999], [15, 5, 999]])
+
+    def test_assign_zones(self):
+        labels = self.zonal_stats.assign_zones(self.cloud_points.astype(float))
+        self.assertEqual([0, 0, 0, 1, -1, 2, 2, -1, -1], labels.tolist())
+
+    def test_assign_zones_resolution(self):
+        for resolution in [0.3, 4, 50]:
+            zonal_stats = ZonalStats(self.zones, resolution=resolution)
+            labels = zonal_stats.assign_zones(self.cloud_points.astype(float))
+            self.assertEqual([0, 0, 0, 1, -1, 2, 2, -1, -1], labels.tolist())
+
+    def test_compute_chunks(self):
+        whole = self.zonal_stats.compute([self.cloud_points])
+        chunked = self.zonal_stats.compute(np.array_split(self.cloud_points, 4))
+
+        self.assertEqual([3, 1, 2], chunked['count'].tolist())
+        self.assertEqual([105, 200, 305], chunked['mean_elevation'].tolist())
+        self.assertEqual([10, 0, 10], chunked['relief'].tolist())
+        self.assertTrue(whole.equals(chunked))
+
+    def test_point_density(self):
+        stats = self.zonal_stats.compute([self.cloud_points])
+        self.assertAlmostEqual(3 / 100, stats['point_density'][0])
+        self.assertAlmostEqual(1 / 96, stats['point_density'][1])
+        self.assertAlmostEqual(2 / 50, stats['point_density'][2])
+
+    def test_empty_zone(self):
+        stats = self.zonal_stats.compute([self.cloud_points[:3]])
+        self.assertEqual(0, stats['count'][1])
+        self.assertTrue(np.isnan(stats['mean_elevation'][1]))
+
+    def test_empty_geometries(self):
+        zones = gpd.GeoDataFrame(geometry=[Polygon(), None, self.zones.geometry[0]])
+        stats = ZonalStats(zones).compute([self.cloud_points])
+
+        self.assertEqual([0, 0, 3], stats['count'].tolist())
+        self.assertTrue(stats.loc[:1, ['mean_elevation', 'relief', 'point_density']].isna().all().all())
+
+    def test_empty_chunks(self):
+        stats = self.zonal_stats.compute([[], np.empty((0, 3)), [5, 5, 100]])
+        self.assertEqual([1, 0, 0], stats['count'].tolist())
+
+    def test_missing_elevation(self):
+        stats = self.zonal_stats.compute([[[1, 1, np.nan], [2, 2, 100], [np.nan, 2, 100]]])
+        self.assertEqual(1, stats['count'][0])
+        self.assertEqual(100, stats['mean_elevation'][0])
+
+    def test_epsg_reprojection(self):
+        zones = self.zones.set_crs(epsg=3857).to_crs(epsg=4326)
+        stats = ZonalStats(zones, epsg='3857').compute([self.cloud_points])
+        self.assertEqual([3, 1, 2], stats['count'].tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()